@@ -0,0 +1,13 @@
+# Production server settings, used as: gunicorn main:app -c gunicorn.conf.py
+import multiprocessing
+import os
+
+bind = os.environ.get("BIND", "0.0.0.0:8000")
+workers = int(os.environ.get("WEB_CONCURRENCY", multiprocessing.cpu_count()))
+# Picks up uvloop and httptools automatically when they are installed
+worker_class = "uvicorn.workers.UvicornWorker"
+# Import the app once in the master so workers share its memory
+# copy-on-write. Sockets and connections (Hugging Face client, SQLite
+# pool, Redis) are opened in the app lifespan, i.e. in each worker.
+preload_app = True
+logconfig_json = "log_config.json"
@@ -1,69 +1,537 @@
-import json
-import traceback
-from fastapi import FastAPI, HTTPException
+import asyncio
+import hashlib
+import logging
+from fastapi import FastAPI, HTTPException, Query, Request, Response
 from fastapi.middleware.cors import CORSMiddleware
-from pydantic import BaseModel
-import requests
+from fastapi.responses import ORJSONResponse
+from pydantic import BaseModel, ConfigDict, StringConstraints
+import httpx
+import orjson
+import redis.asyncio as redis
 import os
+from cachetools import TTLCache
 from dotenv import load_dotenv
 import sqlite3
+import queue
+import re
+import threading
+import time
 from contextlib import asynccontextmanager, contextmanager
-from typing import Optional
+from datetime import datetime, timezone
+from typing import Annotated, Optional
+from tenacity import retry, retry_if_exception, stop_after_attempt, wait_exponential_jitter
 
 # Load environment variables
 load_dotenv()
 
+log = logging.getLogger(__name__)
+
 # Configures database path - allow customization via environment variable
 # Helps in testing where file paths might be restricted
 DATABASE_URL = os.environ.get('DATABASE_URL', 'ai-explorer.db')
+# Number of pooled read connections used by /api/history
+DB_READERS = int(os.environ.get('DB_READERS', '4'))
+# New request logs go to one SQLite file per month (requests_YYYYMM.db
+# next to DATABASE_URL), attached to every connection as logs_YYYYMM.
+# The newest LOG_RETENTION_MONTHS stay attached for /api/history and older
+# files are deleted. SQLite allows at most 10 attached databases
+MAX_ATTACHED = 10
+LOG_RETENTION_MONTHS = min(max(int(os.environ.get('LOG_RETENTION_MONTHS', '3')), 1), MAX_ATTACHED)
+LOG_MAINTENANCE_INTERVAL = 3600
+# Rows older than this are pruned from the main database's requests table
+MAIN_RETENTION_DAYS = 90
+# Hugging Face Inference API, built once rather than per request
+HF_API_URL = "https://api-inference.huggingface.co"
+HF_HEADERS = {"Authorization": f"Bearer {os.environ.get('HF_API_KEY', '')}"}
+SUMMARIZE_URL = "/models/facebook/bart-large-cnn"
+SENTIMENT_URL = "/models/finiteautomata/bertweet-base-sentiment-analysis"
+JSON_HEADERS = {"Content-Type": "application/json"}
+SENTIMENT_MAP = {
+    "POS": "POSITIVE",
+    "NEG": "NEGATIVE",
+    "NEU": "NEUTRAL"
+}
+
+# Concurrent requests for the same model are sent to Hugging Face as one
+# list input: up to HF_BATCH_SIZE texts, waiting at most HF_BATCH_WAIT
+# seconds after the first for the batch to fill
+HF_BATCH_SIZE = 8
+HF_BATCH_WAIT = 0.02
+
+# Retry policy for transient Hugging Face failures (429, 5xx, transport
+# errors), and the circuit breaker that fails fast during an outage
+HF_RETRY_ATTEMPTS = 3
+HF_RETRY_AFTER_MAX = 10
+HF_BREAKER_FAIL_MAX = 5
+HF_BREAKER_RESET_TIMEOUT = 30
+
+# Longest text accepted by the AI endpoints
+TEXT_MAX_LENGTH = 8192
+
+# /api/history page size cap, and how much of each text it returns
+HISTORY_MAX_LIMIT = 200
+HISTORY_TEXT_LENGTH = 500
+
+# Request logs are written in batches: up to LOG_BATCH_SIZE rows per
+# transaction, gathered for LOG_FLUSH_INTERVAL seconds after the first one
+LOG_BATCH_SIZE = 500
+LOG_FLUSH_INTERVAL = 0.05
+
+# In-process caches of model results, so repeated inputs skip Hugging Face
+CACHE_MAXSIZE = 10_000
+CACHE_TTL = 3600
+SUMMARY_CACHE = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL)
+SENTIMENT_CACHE = TTLCache(maxsize=CACHE_MAXSIZE, ttl=CACHE_TTL)
+
+# Shared cache across uvicorn workers and restarts; optional, lookups
+# fall through to Hugging Face when Redis is unreachable
+REDIS_URL = os.environ.get('REDIS_URL', 'redis://localhost:6379')
+REDIS_TTL = 86400
+# After a Redis error the shared cache is skipped for this many seconds
+REDIS_RETRY_INTERVAL = 30
+
+# Hugging Face calls in progress, keyed by (cache prefix, cache key)
+INFLIGHT: dict = {}
+
+def cache_key(text: str) -> bytes:
+    return hashlib.blake2b(text.encode(), digest_size=16).digest()
+
+def redis_available(app: FastAPI) -> bool:
+    return time.monotonic() >= app.state.redis_retry_at
+
+def redis_failed(app: FastAPI, e: Exception):
+    """Skip Redis for REDIS_RETRY_INTERVAL, warning once per outage."""
+    if not app.state.redis_down:
+        log.warning("Redis unavailable, skipping the shared cache: %s", e)
+        app.state.redis_down = True
+    app.state.redis_retry_at = time.monotonic() + REDIS_RETRY_INTERVAL
 
-def init_db():
+def redis_ok(app: FastAPI):
+    if app.state.redis_down:
+        log.info("Redis is reachable again")
+        app.state.redis_down = False
+
+async def get_cached(app: FastAPI, prefix: str, local_cache: TTLCache, key: bytes):
+    """Look a result up in the in-process cache, then in Redis."""
+    result = local_cache.get(key)
+    if result is not None or not redis_available(app):
+        return result
+    try:
+        cached = await app.state.redis.get(f"{prefix}:{key.hex()}")
+    except (redis.RedisError, OSError) as e:
+        redis_failed(app, e)
+        return None
+    redis_ok(app)
+    if cached is None:
+        return None
+    result = orjson.loads(cached)
+    local_cache[key] = result
+    return result
+
+async def single_flight(flight_key, fetch):
+    """Run fetch() once for all concurrent callers with the same flight_key.
+
+    The call runs as its own task and every caller, the first included,
+    awaits it through a shield. A caller that goes away is cancelled
+    alone; the others still get the result or exception.
+    """
+    task = INFLIGHT.get(flight_key)
+    if task is None:
+        task = asyncio.create_task(fetch())
+        INFLIGHT[flight_key] = task
+
+        def finished(done):
+            if INFLIGHT.get(flight_key) is done:
+                del INFLIGHT[flight_key]
+            # Mark any exception retrieved, every caller may have gone away
+            if not done.cancelled():
+                done.exception()
+
+        task.add_done_callback(finished)
+    return await asyncio.shield(task)
+
+async def set_cached(app: FastAPI, prefix: str, local_cache: TTLCache, key: bytes, result):
+    local_cache[key] = result
+    if not redis_available(app):
+        return
+    try:
+        await app.state.redis.set(f"{prefix}:{key.hex()}", orjson.dumps(result), ex=REDIS_TTL)
+    except (redis.RedisError, OSError) as e:
+        redis_failed(app, e)
+        return
+    redis_ok(app)
+
+def apply_pragmas(conn):
+    """Tune a connection for concurrent reads alongside request logging."""
+    cursor = conn.cursor()
+    # WAL lets /api/history read while a log write is in progress.
+    # In-memory databases don't support it, so skip it there.
+    if DATABASE_URL != ':memory:':
+        cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.execute("PRAGMA cache_size=-65536")
+    cursor.execute("PRAGMA busy_timeout=3000")
+
+def connect_db():
+    """Open a connection to DATABASE_URL that can be shared across threads."""
     # Make sure the directory exists if using a path with directories
     if DATABASE_URL != ':memory:' and '/' in DATABASE_URL:
         os.makedirs(os.path.dirname(DATABASE_URL), exist_ok=True)
 
-    try:
-        with sqlite3.connect(DATABASE_URL) as conn:
-            cursor = conn.cursor()
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS requests (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    endpoint TEXT NOT NULL,
-                    input_text TEXT NOT NULL,
-                    result TEXT NOT NULL,
-                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                )
-            """)
-            conn.commit()
-        print(f"Database successfully initialized at {DATABASE_URL}")
-    except Exception as e:
-        print(f"Error initializing database: {str(e)}")
-        print(traceback.format_exc())
-        # Continue without failing - if database is not critical
+    conn = sqlite3.connect(DATABASE_URL, check_same_thread=False, isolation_level=None)
+    apply_pragmas(conn)
+    return conn
+
+def create_requests_table(conn, schema: str = "main"):
+    cursor = conn.cursor()
+    cursor.execute(f"""
+        CREATE TABLE IF NOT EXISTS {schema}.requests (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            endpoint TEXT NOT NULL,
+            input_text TEXT NOT NULL,
+            result TEXT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+    # Lets /api/history walk the newest rows without sorting the table.
+    # SQLite scans it backwards for ORDER BY timestamp DESC, and the
+    # implicit rowid keeps ties in id order
+    cursor.execute(f"CREATE INDEX IF NOT EXISTS {schema}.ix_requests_ts ON requests(timestamp)")
 
-@contextmanager
-def get_db():
-    """Context manager for db connections."""
+def init_db(conn=None):
+    """Create the schema on `conn`, or on a fresh connection if none is given."""
+    own_conn = conn is None
     try:
-        conn = sqlite3.connect(DATABASE_URL)
-        yield conn
-    except Exception as e:
-        print(f"Database connection error: {str(e)}")
-        print(traceback.format_exc())
-        raise
+        if own_conn:
+            conn = connect_db()
+        create_requests_table(conn)
+        conn.commit()
+        log.info("Database successfully initialized at %s", DATABASE_URL)
+    except Exception:
+        log.exception("Error initializing database")
+        # Continue without failing - if database is not critical
     finally:
-        if 'conn' in locals() and conn:
+        if own_conn and conn:
             conn.close()
 
+def log_months(now: Optional[datetime] = None) -> list:
+    """The LOG_RETENTION_MONTHS most recent months as YYYYMM, newest first."""
+    now = now or datetime.now(timezone.utc)
+    year, month = now.year, now.month
+    months = []
+    for _ in range(LOG_RETENTION_MONTHS):
+        months.append(f"{year}{month:02d}")
+        month -= 1
+        if month == 0:
+            year, month = year - 1, 12
+    return months
+
+def log_db_path(month: str) -> str:
+    if DATABASE_URL == ':memory:':
+        return ':memory:'
+    return os.path.join(os.path.dirname(DATABASE_URL), f"requests_{month}.db")
+
+def prune_log_files(oldest_month: str):
+    """Delete monthly log files (and their WAL files) older than oldest_month."""
+    if DATABASE_URL == ':memory:':
+        return
+    directory = os.path.dirname(DATABASE_URL) or '.'
+    for name in os.listdir(directory):
+        match = re.fullmatch(r"requests_(\d{6})\.db(-wal|-shm)?", name)
+        if match and match.group(1) < oldest_month:
+            try:
+                os.remove(os.path.join(directory, name))
+                log.info("Deleted expired request log %s", name)
+            except OSError:
+                # Still open somewhere (e.g. on Windows); retried next run
+                log.warning("Could not delete expired request log %s", name, exc_info=True)
+
+class ConnectionPool:
+    """A single writer connection plus a queue of reader connections.
+
+    Connections are opened once at startup so the PRAGMA setup and the
+    page cache survive between requests. Each connection also has the
+    monthly log databases in `months` attached; rotate() changes that set
+    and connections catch up the next time they are handed out. Handing
+    out a connection also rotates once the month has turned, so every
+    worker follows the clock, not just the one whose flusher wrote first.
+    """
+
+    def __init__(self, readers: int = DB_READERS):
+        self.write_conn = connect_db()
+        self.write_lock = threading.Lock()
+        self.read_conns = queue.Queue()
+        # Every ':memory:' connection is a separate database, so readers
+        # have to share the writer there.
+        if DATABASE_URL != ':memory:':
+            for _ in range(readers):
+                self.read_conns.put(connect_db())
+        self.months = []
+        self.attached = {}
+
+    def sync_attachments(self, conn, months):
+        """Attach and detach monthly log databases on `conn` to match `months`."""
+        have = self.attached.setdefault(conn, set())
+        for month in have - set(months):
+            conn.execute(f"DETACH DATABASE logs_{month}")
+            have.discard(month)
+        for month in set(months) - have:
+            conn.execute(f"ATTACH DATABASE ? AS logs_{month}", (log_db_path(month),))
+            if DATABASE_URL != ':memory:':
+                conn.execute(f"PRAGMA logs_{month}.journal_mode=WAL")
+            conn.execute(f"PRAGMA logs_{month}.synchronous=NORMAL")
+            have.add(month)
+
+    def rotate(self, months):
+        """Attach the log databases for `months` (newest first).
+
+        Only the current month gets a table; older months are attached
+        only if their file already exists, so no empty files are made.
+        """
+        attach = [months[0]] + [
+            month for month in months[1:]
+            if DATABASE_URL != ':memory:' and os.path.exists(log_db_path(month))
+        ]
+        with self.write_lock:
+            # The table is created before the new set is published, so a
+            # reader never attaches a month without a requests table
+            self.sync_attachments(self.write_conn, attach)
+            create_requests_table(self.write_conn, f"logs_{months[0]}")
+            self.months = attach
+
+    @property
+    def current_month(self) -> Optional[str]:
+        return self.months[0] if self.months else None
+
+    @property
+    def current_log(self) -> str:
+        return f"logs_{self.current_month}" if self.months else "main"
+
+    def follow_clock(self):
+        """Rotate if the month has turned since the last rotate().
+
+        A failed rotation is logged and the previous months stay attached.
+        """
+        months = log_months()
+        if months[0] != self.current_month:
+            try:
+                self.rotate(months)
+            except Exception:
+                log.exception("Error rotating request logs")
+
+    @contextmanager
+    def get_writer(self):
+        # rotate() takes the write lock itself, so check before taking it
+        self.follow_clock()
+        with self.write_lock:
+            self.sync_attachments(self.write_conn, self.months)
+            yield self.write_conn
+
+    @contextmanager
+    def get_reader(self):
+        if DATABASE_URL == ':memory:':
+            with self.get_writer() as conn:
+                yield conn
+            return
+        self.follow_clock()
+        conn = self.read_conns.get()
+        try:
+            self.sync_attachments(conn, self.months)
+            yield conn
+        finally:
+            self.read_conns.put(conn)
+
+    def close(self):
+        while not self.read_conns.empty():
+            self.read_conns.get_nowait().close()
+        with self.write_lock:
+            self.write_conn.close()
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling Hugging Face while the breaker is open."""
+
+class CircuitBreaker:
+    """Fails fast for reset_timeout seconds after fail_max consecutive failures.
+
+    Only retryable failures count; a client error such as a 413 says
+    nothing about upstream health. Once the timeout passes, calls go
+    through again and the first success closes the breaker.
+    """
+
+    def __init__(self, fail_max: int, reset_timeout: float):
+        self.fail_max = fail_max
+        self.reset_timeout = reset_timeout
+        self.failures = 0
+        self.opened_at = None
+
+    async def call(self, func, *args):
+        if self.opened_at is not None and time.monotonic() - self.opened_at < self.reset_timeout:
+            raise CircuitOpenError("Hugging Face API is unavailable, try again shortly")
+        try:
+            result = await func(*args)
+        except Exception as e:
+            if is_retryable(e):
+                self.failures += 1
+                if self.failures >= self.fail_max:
+                    self.opened_at = time.monotonic()
+            raise
+        self.failures = 0
+        self.opened_at = None
+        return result
+
+def is_retryable(exc: BaseException) -> bool:
+    if isinstance(exc, httpx.HTTPStatusError):
+        return exc.response.status_code == 429 or exc.response.status_code >= 500
+    return isinstance(exc, httpx.TransportError)
+
+def is_input_error(exc: BaseException) -> bool:
+    """Whether a failed batch may be down to one of its inputs, not to upstream."""
+    if isinstance(exc, httpx.HTTPStatusError):
+        return 400 <= exc.response.status_code < 500 and exc.response.status_code != 429
+    return isinstance(exc, ValueError)
+
+_hf_backoff = wait_exponential_jitter(initial=0.2, max=2, jitter=0.2)
+
+def wait_hf_retry(retry_state) -> float:
+    """Wait as long as Retry-After asks (capped), else back off with jitter."""
+    exc = retry_state.outcome.exception()
+    if isinstance(exc, httpx.HTTPStatusError):
+        retry_after = exc.response.headers.get("Retry-After", "")
+        if retry_after.isdigit():
+            return min(float(retry_after), HF_RETRY_AFTER_MAX)
+    return _hf_backoff(retry_state)
+
+@retry(
+    retry=retry_if_exception(is_retryable),
+    stop=stop_after_attempt(HF_RETRY_ATTEMPTS),
+    wait=wait_hf_retry,
+    reraise=True,
+)
+async def post_hf(client: httpx.AsyncClient, url: str, body: bytes) -> httpx.Response:
+    response = await client.post(url, content=body, headers=JSON_HEADERS)
+    response.raise_for_status()  # This will raise an exception for HTTP errors
+    return response
+
+def parse_hf(content: bytes) -> list:
+    """Decode a Hugging Face response body, which must be a non-empty list."""
+    data = orjson.loads(content)
+    if not isinstance(data, list) or not data:
+        raise ValueError("Invalid response format from API")
+    return data
+
+class HFBatcher:
+    """Micro-batches texts for one Hugging Face model.
+
+    submit() queues a text and waits for its output. A dispatcher task
+    gathers queued texts into batches and posts each batch as a single
+    list input, then hands every caller the output at its own index.
+    Each model has its own circuit breaker, so one model loading or
+    failing doesn't block calls to the other.
+    """
+
+    def __init__(self, client: httpx.AsyncClient, url: str, parameters: Optional[dict] = None):
+        self.client = client
+        self.url = url
+        # The constant part of the JSON body is encoded once; only the
+        # inputs are serialized per batch
+        if parameters:
+            self.body_prefix = b'{"parameters":' + orjson.dumps(parameters) + b',"inputs":'
+        else:
+            self.body_prefix = b'{"inputs":'
+        self.breaker = CircuitBreaker(HF_BREAKER_FAIL_MAX, HF_BREAKER_RESET_TIMEOUT)
+        self.queue = asyncio.Queue()
+        self.pending = set()
+        self.task = asyncio.create_task(self.run())
+
+    async def submit(self, text: str):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((text, future))
+        return await future
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self.queue.get()]
+            deadline = loop.time() + HF_BATCH_WAIT
+            while len(batch) < HF_BATCH_SIZE:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self.queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+            # Don't wait for the call, so the next batch can fill meanwhile
+            task = asyncio.create_task(self.dispatch(batch))
+            self.pending.add(task)
+            task.add_done_callback(self.pending.discard)
+
+    async def dispatch(self, batch):
+        body = self.body_prefix + orjson.dumps([text for text, _ in batch]) + b'}'
+        try:
+            response = await self.breaker.call(post_hf, self.client, self.url, body)
+            outputs = parse_hf(response.content)
+            if len(outputs) != len(batch):
+                raise ValueError("Invalid response format from API")
+        except Exception as e:
+            # A client error or malformed reply may come from one bad input;
+            # send each text alone so only its own caller gets the error
+            if len(batch) > 1 and is_input_error(e):
+                await asyncio.gather(*(self.dispatch([item]) for item in batch))
+                return
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        for (_, future), output in zip(batch, outputs):
+            if not future.done():
+                future.set_result(output)
+
+    async def close(self):
+        self.task.cancel()
+        await asyncio.gather(self.task, *self.pending, return_exceptions=True)
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    # Startup
-    init_db()
+    # Startup. Everything holding a socket or file handle is created here,
+    # per worker, never at import: gunicorn --preload imports before forking
+    app.state.db = ConnectionPool()
+    with app.state.db.get_writer() as conn:
+        init_db(conn)
+    maintain_logs(app.state.db)
+    app.state.log_maintenance = asyncio.create_task(run_log_maintenance(app))
+    app.state.log_queue = asyncio.Queue()
+    app.state.log_flusher = asyncio.create_task(flush_logs(app))
+    # Shared Hugging Face client: keeps TLS connections alive between requests
+    app.state.hf = httpx.AsyncClient(
+        base_url=HF_API_URL,
+        http2=True,
+        timeout=30,
+        headers=HF_HEADERS,
+        limits=httpx.Limits(max_connections=100, max_keepalive_connections=20),
+    )
+    app.state.redis = redis.from_url(
+        REDIS_URL, decode_responses=True, socket_connect_timeout=0.5, socket_timeout=0.5
+    )
+    app.state.redis_down = False
+    app.state.redis_retry_at = 0.0
+    app.state.summarizer = HFBatcher(app.state.hf, SUMMARIZE_URL, {"max_length": 100})
+    app.state.sentiment = HFBatcher(app.state.hf, SENTIMENT_URL)
     yield
-    # Shutdown, cleanup if needed
+    # Shutdown, writing out any queued log rows first
+    await app.state.log_queue.put(None)
+    await app.state.log_flusher
+    app.state.log_maintenance.cancel()
+    await app.state.summarizer.close()
+    await app.state.sentiment.close()
+    await app.state.hf.aclose()
+    await app.state.redis.aclose()
+    app.state.db.close()
 
 # Initialize FastAPI with lifespan function
-app = FastAPI(title="AI Methods Explorer", lifespan=lifespan)
+app = FastAPI(title="AI Methods Explorer", lifespan=lifespan, default_response_class=ORJSONResponse)
 
 # Configure CORS, allowing requests from the frontend
 app.add_middleware(
@@ -76,24 +544,73 @@ app.add_middleware(
 
 # Define data models
 class TextInput(BaseModel):
-    text: str
+    # Immutable, and oversized bodies are rejected before reaching a handler
+    model_config = ConfigDict(frozen=True)
+
+    text: Annotated[str, StringConstraints(max_length=TEXT_MAX_LENGTH, strip_whitespace=True)]
 
 class AIResponse(BaseModel):
     endpoint: str
     input_text: str
     result: str
 
-def log_request(db, endpoint: str, input_text: str, result: str):
+def log_requests(db, rows, schema: str = "main"):
+    """Insert (endpoint, input_text, result) rows in a single transaction."""
     try:
-        cursor = db.cursor()
-        cursor.execute("""
-            INSERT INTO requests (endpoint, input_text, result)
+        db.execute("BEGIN")
+        db.executemany(f"""
+            INSERT INTO {schema}.requests (endpoint, input_text, result)
             VALUES (?, ?, ?)
-        """, (endpoint, input_text, result)
+        """, rows)
+        db.execute("COMMIT")
+    except Exception:
+        if db.in_transaction:
+            db.rollback()
+        log.exception("Error logging requests")
+
+def write_log_batch(pool: ConnectionPool, rows):
+    # get_writer() switches to the new month's database as soon as the
+    # month turns. If that fails, the rows go to the previous month's
+    with pool.get_writer() as db:
+        log_requests(db, rows, pool.current_log)
+
+def maintain_logs(pool: ConnectionPool):
+    """Rotate the attached log databases and delete expired logs."""
+    months = log_months()
+    pool.rotate(months)
+    prune_log_files(months[-1])
+    with pool.get_writer() as db:
+        db.execute(
+            "DELETE FROM main.requests WHERE timestamp < datetime('now', ?)",
+            (f"-{MAIN_RETENTION_DAYS} days",)
         )
-        db.commit()
-    except Exception as e:
-        print(f"Error logging request: {str(e)}")
+
+async def run_log_maintenance(app: FastAPI):
+    while True:
+        await asyncio.sleep(LOG_MAINTENANCE_INTERVAL)
+        try:
+            await asyncio.to_thread(maintain_logs, app.state.db)
+        except Exception:
+            log.exception("Log maintenance failed")
+
+async def flush_logs(app: FastAPI):
+    """Drain app.state.log_queue into SQLite until a None sentinel arrives."""
+    log_queue = app.state.log_queue
+    while True:
+        rows = [await log_queue.get()]
+        await asyncio.sleep(LOG_FLUSH_INTERVAL)
+        while len(rows) < LOG_BATCH_SIZE and not log_queue.empty():
+            rows.append(log_queue.get_nowait())
+        stop = None in rows
+        rows = [row for row in rows if row is not None]
+        if rows:
+            # A failed batch is dropped; the flusher must keep running
+            try:
+                await asyncio.to_thread(write_log_batch, app.state.db, rows)
+            except Exception:
+                log.exception("Error writing %d request log rows", len(rows))
+        if stop:
+            return
 
 # Root endpoint
 @app.get("/")
@@ -103,110 +620,165 @@ def read_root():
 # AI Methods
 # Text Summarization
 @app.post("/api/summarize")
-async def summarize_text(input_data: TextInput):
+async def summarize_text(input_data: TextInput, request: Request):
     # Simple integration with Hugging Face Inference API
-    API_URL = "https://api-inference.huggingface.co/models/facebook/bart-large-cnn"
-    headers = {"Authorization": f"Bearer {os.getenv('HF_API_KEY', '')}"}
+    key = cache_key(input_data.text)
+    cached = await get_cached(request.app, "sum", SUMMARY_CACHE, key)
+    if cached is not None:
+        return {"result": cached}
+
+    async def fetch_summary():
+        result = await request.app.state.summarizer.submit(input_data.text)
+        summary = result["summary_text"]
+        await set_cached(request.app, "sum", SUMMARY_CACHE, key, summary)
+        # Queued for the background flusher, SQLite stays off the response path
+        await request.app.state.log_queue.put(("summarize", input_data.text, summary))
+        return summary
     
     try:
-        response = requests.post(
-            API_URL,
-            headers=headers,
-            json={"inputs": input_data.text, "parameters": {"max_length": 100}}
-        )
-        response.raise_for_status()  # This will raise an exception for HTTP errors
-        result = response.json()
-        if not result or not isinstance(result, list) or len(result) == 0:
-            raise ValueError("Invalid response format from API")
-        # TODO: Log request to db
-        with get_db() as db:
-            log_request(db, "summarize", input_data.text, result[0]["summary_text"])
-        return {"result": result[0]["summary_text"]}
+        summary = await single_flight(("sum", key), fetch_summary)
+        return {"result": summary}
     
-    except requests.exceptions.RequestException as e:
+    except httpx.HTTPStatusError as e:
+        if e.response.status_code == 413:
+            raise HTTPException(status_code=413, detail="Input text is too long for the model")
+        raise HTTPException(status_code=500, detail=f"API request failed: {str(e)}")
+    except httpx.RequestError as e:
         raise HTTPException(status_code=500, detail=f"API request failed: {str(e)}")
+    except CircuitOpenError as e:
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
     
 # Sentiment Analysis
 @app.post("/api/sentiment")
-async def analyze_sentiment(input_data: TextInput):
+async def analyze_sentiment(input_data: TextInput, request: Request):
     # Using a different sentiment analysis model
-    API_URL = "https://api-inference.huggingface.co/models/finiteautomata/bertweet-base-sentiment-analysis"
-    headers = {"Authorization": f"Bearer {os.getenv('HF_API_KEY', '')}"}
-    
-    try:
-        response = requests.post(
-            API_URL,
-            headers=headers,
-            json={"inputs": input_data.text}
-        )
-        response.raise_for_status()
-        sentiment_data = response.json()
-        print(f"API Response: {sentiment_data}")  # Debug log
+    # The model only looks at a short prefix; truncate locally rather than
+    # mutating the request model
+    text = input_data.text[:512]
+    key = cache_key(text)
+    cached = await get_cached(request.app, "sent", SENTIMENT_CACHE, key)
+    if cached is not None:
+        return cached
+
+    async def fetch_sentiment():
+        sentiment_data = await request.app.state.sentiment.submit(text)
+        log.debug("API Response: %s", sentiment_data)
         
         if not sentiment_data:
             raise ValueError("Empty response from API")
             
         # Process the new model's output format
-        result = sentiment_data[0][0]  # Get the highest confidence result
-        sentiment_map = {
-            "POS": "POSITIVE",
-            "NEG": "NEGATIVE",
-            "NEU": "NEUTRAL"
-        }
-        return {
-            "sentiment": sentiment_map.get(result["label"], "NEUTRAL"),
+        # Get the highest confidence result in one pass, without assuming order
+        result = max(sentiment_data, key=lambda x: x["score"])
+        sentiment = SENTIMENT_MAP.get(result["label"], "NEUTRAL")
+        response_data = {
+            "sentiment": sentiment,
             "score": result["score"]
         }
-    except requests.exceptions.RequestException as e:
-        print(f"API request failed: {str(e)}")
+        await set_cached(request.app, "sent", SENTIMENT_CACHE, key, response_data)
+        await request.app.state.log_queue.put(("sentiment", text, sentiment))
+        return response_data
+    
+    try:
+        return await single_flight(("sent", key), fetch_sentiment)
+    except httpx.HTTPStatusError as e:
+        log.warning("API request failed: %s", e)
+        if e.response.status_code == 413:
+            raise HTTPException(status_code=413, detail="Input text is too long for the model")
+        raise HTTPException(status_code=500, detail=f"API request failed: {str(e)}")
+    except httpx.RequestError as e:
+        log.warning("API request failed: %s", e)
         raise HTTPException(status_code=500, detail=f"API request failed: {str(e)}")
+    except CircuitOpenError as e:
+        log.warning("API request skipped: %s", e)
+        raise HTTPException(status_code=503, detail=str(e))
     except Exception as e:
-        print(f"Processing failed: {str(e)}")
+        log.exception("Processing failed")
         raise HTTPException(status_code=500, detail=f"Error processing request: {str(e)}")
     
+# Available AI methods never change at runtime, so the body and its ETag
+# are built once at import
+METHODS_PAYLOAD = {
+    "methods": [
+        {
+            "id": "summarize",
+            "name": "Text Summarization",
+            "description": "Condenses long text into a shorter summary while preserving key information.",
+            "model": "facebook/bart-large-cnn",
+            "endpoint": "/api/summarize"
+        },
+        {
+            "id": "sentiment",
+            "name": "Sentiment Analysis",
+            "description": "Analyzes the sentiment, emotional tone of a text (positive/negative/neutral) and returns a score.",
+            "model": "finiteautomata/bertweet-base-sentiment-analysis",
+            "endpoint": "/api/sentiment"
+        }
+    ]
+}
+METHODS_BODY = orjson.dumps(METHODS_PAYLOAD)
+METHODS_ETAG = f'"{hashlib.md5(METHODS_BODY).hexdigest()}"'
+METHODS_HEADERS = {"Cache-Control": "public, max-age=86400", "ETag": METHODS_ETAG}
+
 # Get available AI methods
 @app.get("/api/methods")
-async def get_available_methods():
-    return {
-        "methods": [
-            {
-                "id": "summarize",
-                "name": "Text Summarization",
-                "description": "Condenses long text into a shorter summary while preserving key information.",
-                "model": "facebook/bart-large-cnn",
-                "endpoint": "/api/summarize"
-            },
-            {
-                "id": "sentiment",
-                "name": "Sentiment Analysis",
-                "description": "Analyzes the sentiment, emotional tone of a text (positive/negative/neutral) and returns a score.",
-                "model": "finiteautomata/bertweet-base-sentiment-analysis",
-                "endpoint": "/api/sentiment"
-            }
-        ]
-    }
+async def get_available_methods(request: Request):
+    if_none_match = request.headers.get("if-none-match", "")
+    if METHODS_ETAG in if_none_match or if_none_match.strip() == "*":
+        return Response(status_code=304, headers=METHODS_HEADERS)
+    return Response(content=METHODS_BODY, media_type="application/json", headers=METHODS_HEADERS)
 
-# TODO: Recent API usage history
+# Recent API usage history, newest first, across the main table and the
+# attached monthly log databases. Pages are keyed on
+# (timestamp, id): pass the returned next_before as `before` to continue.
+# A plain def, so FastAPI runs it in the threadpool: the blocking pool
+# checkout and SQLite reads stay off the event loop, and concurrent
+# requests can use several reader connections at once
 @app.get("/api/history")
-async def get_request_history(limit: int = 10):
-    with get_db() as db:
-        cursor = db.cursor()
-        cursor.execute(
-            "SELECT endpoint, input_text, result, timestamp FROM requests ORDER BY timestamp DESC LIMIT ?",
-            (limit,)
+def get_request_history(
+    request: Request,
+    limit: int = Query(10, ge=1, le=HISTORY_MAX_LIMIT),
+    before: Optional[str] = None,
+):
+    if before is None:
+        where, params = "", ()
+    else:
+        try:
+            before_ts, before_id = before.rsplit("|", 1)
+            params = (before_ts, int(before_id))
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid 'before' cursor")
+        where = "WHERE (timestamp, id) < (?, ?)"
+
+    with request.app.state.db.get_reader() as db:
+        # Older rows live in main, newer ones in the attached monthly logs
+        schemas = [
+            name for _, name, _ in db.execute("PRAGMA database_list")
+            if name == "main" or name.startswith("logs_")
+        ]
+        query = " UNION ALL ".join(
+            f"SELECT id, endpoint, substr(input_text, 1, ?), substr(result, 1, ?), timestamp "
+            f"FROM {schema}.requests {where}"
+            for schema in schemas
         )
-        records = cursor.fetchall()
-        
-        return {
-            "history": [
-                {
-                    "endpoint": record[0],
-                    "input_text": record[1],
-                    "result": record[2],
-                    "timestamp": record[3]
-                }
-                for record in records
-            ]
-        }
\ No newline at end of file
+        cursor = db.execute(
+            f"{query} ORDER BY timestamp DESC, id DESC LIMIT ?",
+            (HISTORY_TEXT_LENGTH, HISTORY_TEXT_LENGTH, *params) * len(schemas) + (limit,)
+        )
+        history = []
+        next_before = None
+        for record_id, endpoint, input_text, result, timestamp in cursor:
+            history.append({
+                "endpoint": endpoint,
+                "input_text": input_text,
+                "result": result,
+                "timestamp": timestamp
+            })
+            next_before = f"{timestamp}|{record_id}"
+
+    # A short page means there is nothing older to fetch
+    if len(history) < limit:
+        next_before = None
+    return {"history": history, "next_before": next_before}
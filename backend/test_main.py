@@ -1,25 +1,58 @@
 from fastapi.testclient import TestClient
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+import httpx
+import orjson
 import pytest
 import os
-import sqlite3
-from unittest.mock import patch
-from main import app
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+import redis.asyncio as redis
 
-# Patch sqlite3.connect to use an in-memory database before importing main
-# This ensures all database operations use the in-memory database
-with patch('sqlite3.connect', return_value=sqlite3.connect(':memory:')):
-    from main import app, init_db
+# Point the app at an in-memory database before importing main, which reads
+# DATABASE_URL at import; tests never touch a real database file
+os.environ["DATABASE_URL"] = ":memory:"
+# Likewise keep tests off any local Redis: nothing listens on port 1, so the
+# cache always misses and no sum:* keys leak between runs
+os.environ["REDIS_URL"] = "redis://127.0.0.1:1"
 
-client = TestClient(app)
+import main
+from main import app, log_requests
 
-init_db()
+@pytest.fixture(scope="module")
+def client():
+    # Entering the client runs the app lifespan (shared HTTP client etc.)
+    with TestClient(app) as c:
+        yield c
 
-def test_read_root():
+@pytest.fixture
+def mock_hf(client):
+    """Route the batchers' Hugging Face calls through an httpx.MockTransport."""
+    batchers = (client.app.state.summarizer, client.app.state.sentiment)
+    originals = [batcher.client for batcher in batchers]
+
+    def install(handler):
+        hf = httpx.AsyncClient(base_url=main.HF_API_URL, transport=httpx.MockTransport(handler))
+        for batcher in batchers:
+            batcher.client = hf
+
+    yield install
+    for batcher, original in zip(batchers, originals):
+        batcher.client = original
+        batcher.breaker = main.CircuitBreaker(main.HF_BREAKER_FAIL_MAX, main.HF_BREAKER_RESET_TIMEOUT)
+
+def summarize_handler(request):
+    """Fake summarization model: echoes each input back as its summary."""
+    inputs = orjson.loads(request.content)["inputs"]
+    return httpx.Response(200, json=[{"summary_text": f"summary of {text}"} for text in inputs])
+
+def test_read_root(client):
     response = client.get("/")
     assert response.status_code == 200 # 200 = OK
     assert response.json() == {"message": "AI Methods Explorer API"} # Expected response
 
-def test_summarize_text():
+def test_summarize_text(client):
 
     if not os.environ.get("HF_API_KEY"):
         pytest.skip("No HF_API_KEY environment variable set")
@@ -31,7 +64,7 @@ def test_summarize_text():
     assert response.status_code == 200
     assert "result" in response.json()
 
-def test_analyze_sentiment():
+def test_analyze_sentiment(client):
     if not os.environ.get("HF_API_KEY"):
         pytest.skip("No HF_API_KEY environment variable set")
 
@@ -50,7 +83,7 @@ def test_analyze_sentiment():
     assert "score" in data
 
 
-def test_get_methods():
+def test_get_methods(client):
     """Test getting available methods."""
     response = client.get("/api/methods")
     assert response.status_code == 200
@@ -62,4 +95,291 @@ def test_get_methods():
     required_fields = ["id", "name", "description", "model", "endpoint"]
     for method in methods:
         for field in required_fields:
-            assert field in method
\ No newline at end of file
+            assert field in method
+
+def test_text_too_long(client):
+    response = client.post("/api/summarize", json={"text": "a" * 8193})
+    assert response.status_code == 422
+
+def test_get_methods_not_modified(client):
+    etag = client.get("/api/methods").headers["etag"]
+    response = client.get("/api/methods", headers={"If-None-Match": etag})
+    assert response.status_code == 304
+
+def test_get_history_pages(client):
+    with client.app.state.db.get_writer() as db:
+        log_requests(db, [("summarize", f"text {i}", f"result {i}") for i in range(3)])
+
+    first = client.get("/api/history", params={"limit": 2}).json()
+    assert len(first["history"]) == 2
+    assert first["next_before"]
+
+    second = client.get("/api/history", params={"limit": 2, "before": first["next_before"]}).json()
+    first_texts = {record["input_text"] for record in first["history"]}
+    assert not first_texts & {record["input_text"] for record in second["history"]}
+
+def test_get_history_limit_bounded(client):
+    response = client.get("/api/history", params={"limit": 100000})
+    assert response.status_code == 422
+
+def test_redis_outage_backs_off(client, mock_hf, monkeypatch):
+    class DownRedis:
+        calls = 0
+
+        async def get(self, *args, **kwargs):
+            DownRedis.calls += 1
+            raise redis.ConnectionError("Redis is down")
+
+        set = get
+
+    mock_hf(summarize_handler)
+    monkeypatch.setattr(client.app.state, "redis", DownRedis())
+    monkeypatch.setattr(client.app.state, "redis_down", False)
+    monkeypatch.setattr(client.app.state, "redis_retry_at", 0.0)
+
+    for text in ("redis outage one", "redis outage two"):
+        response = client.post("/api/summarize", json={"text": text})
+        assert response.json() == {"result": f"summary of {text}"}
+    # The first failure starts the cooldown, later lookups and stores skip Redis
+    assert DownRedis.calls == 1
+
+def test_identical_requests_coalesce(client, mock_hf):
+    inputs = []
+
+    async def handler(request):
+        inputs.extend(orjson.loads(request.content)["inputs"])
+        await asyncio.sleep(0.2)
+        return summarize_handler(request)
+
+    mock_hf(handler)
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        responses = list(pool.map(
+            lambda _: client.post("/api/summarize", json={"text": "coalesced text"}), range(5)
+        ))
+    assert all(r.json() == {"result": "summary of coalesced text"} for r in responses)
+    assert inputs == ["coalesced text"]
+
+def test_single_flight_survives_cancelled_leader():
+    async def scenario():
+        release = asyncio.Event()
+        calls = 0
+
+        async def fetch():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "done"
+
+        leader = asyncio.create_task(main.single_flight(("test", b"leader"), fetch))
+        await asyncio.sleep(0)
+        follower = asyncio.create_task(main.single_flight(("test", b"leader"), fetch))
+        await asyncio.sleep(0)
+        leader.cancel()
+        release.set()
+        return await follower, calls
+
+    assert asyncio.run(scenario()) == ("done", 1)
+
+def run_batcher(handler, texts):
+    """Submit texts concurrently to an HFBatcher backed by a mock transport."""
+    async def scenario():
+        hf = httpx.AsyncClient(base_url=main.HF_API_URL, transport=httpx.MockTransport(handler))
+        batcher = main.HFBatcher(hf, "/models/test")
+        try:
+            return await asyncio.gather(*(batcher.submit(text) for text in texts), return_exceptions=True)
+        finally:
+            await batcher.close()
+            await hf.aclose()
+
+    return asyncio.run(scenario())
+
+def test_batcher_returns_outputs_in_order():
+    batches = []
+
+    def handler(request):
+        inputs = orjson.loads(request.content)["inputs"]
+        batches.append(inputs)
+        return httpx.Response(200, json=[f"out {text}" for text in inputs])
+
+    texts = [f"text {i}" for i in range(5)]
+    assert run_batcher(handler, texts) == [f"out {text}" for text in texts]
+    assert batches == [texts]
+
+def test_batcher_splits_on_length_mismatch():
+    def handler(request):
+        inputs = orjson.loads(request.content)["inputs"]
+        outputs = [f"out {text}" for text in inputs]
+        # Drop an output whenever more than one input is sent
+        return httpx.Response(200, json=outputs[:-1] if len(inputs) > 1 else outputs)
+
+    assert run_batcher(handler, ["a", "b", "c"]) == ["out a", "out b", "out c"]
+
+def test_batcher_isolates_failing_input():
+    def handler(request):
+        inputs = orjson.loads(request.content)["inputs"]
+        if "too long" in inputs:
+            return httpx.Response(413, json={"error": "input too long"})
+        return httpx.Response(200, json=[f"out {text}" for text in inputs])
+
+    results = run_batcher(handler, ["a", "too long", "c"])
+    assert results[0] == "out a" and results[2] == "out c"
+    assert isinstance(results[1], httpx.HTTPStatusError)
+    assert results[1].response.status_code == 413
+
+def test_batcher_sends_full_batch_without_waiting(monkeypatch):
+    monkeypatch.setattr(main, "HF_BATCH_WAIT", 5)
+
+    def handler(request):
+        inputs = orjson.loads(request.content)["inputs"]
+        return httpx.Response(200, json=inputs)
+
+    texts = [str(i) for i in range(main.HF_BATCH_SIZE)]
+    started = time.monotonic()
+    assert run_batcher(handler, texts) == texts
+    assert time.monotonic() - started < 1
+
+def post_with_status(status, headers=None):
+    """Call post_hf against a mock answering `status`; return (error, attempts)."""
+    attempts = 0
+
+    def handler(request):
+        nonlocal attempts
+        attempts += 1
+        return httpx.Response(status, headers=headers)
+
+    async def scenario():
+        async with httpx.AsyncClient(base_url=main.HF_API_URL, transport=httpx.MockTransport(handler)) as hf:
+            try:
+                await main.post_hf(hf, "/models/test", b"{}")
+            except httpx.HTTPStatusError as e:
+                return e
+    error = asyncio.run(scenario())
+    return error, attempts
+
+@pytest.mark.parametrize("status, attempts", [(429, 3), (503, 3), (413, 1), (400, 1)])
+def test_post_hf_retries_only_transient_errors(status, attempts):
+    error, made = post_with_status(status, headers={"Retry-After": "0"})
+    assert error.response.status_code == status
+    assert made == attempts
+
+def test_retry_after_is_capped():
+    def wait_for(headers):
+        error = httpx.HTTPStatusError(
+            "error", request=httpx.Request("POST", main.HF_API_URL),
+            response=httpx.Response(503, headers=headers),
+        )
+        state = SimpleNamespace(outcome=SimpleNamespace(exception=lambda: error), attempt_number=1)
+        return main.wait_hf_retry(state)
+
+    assert wait_for({"Retry-After": "3"}) == 3
+    assert wait_for({"Retry-After": "120"}) == main.HF_RETRY_AFTER_MAX
+    assert wait_for({}) <= 2.2
+
+def test_circuit_breaker_opens_and_resets():
+    breaker = main.CircuitBreaker(fail_max=2, reset_timeout=30)
+    upstream_error = httpx.HTTPStatusError(
+        "error", request=httpx.Request("POST", main.HF_API_URL), response=httpx.Response(503)
+    )
+
+    async def failing():
+        raise upstream_error
+
+    async def working():
+        return "ok"
+
+    async def scenario():
+        for _ in range(2):
+            with pytest.raises(httpx.HTTPStatusError):
+                await breaker.call(failing)
+        with pytest.raises(main.CircuitOpenError):
+            await breaker.call(working)
+        # Once the reset timeout has passed, a successful call closes it
+        breaker.opened_at -= breaker.reset_timeout
+        assert await breaker.call(working) == "ok"
+        assert breaker.opened_at is None and breaker.failures == 0
+
+    asyncio.run(scenario())
+
+def test_breaker_is_per_model(client, mock_hf):
+    def handler(request):
+        if "bart" in request.url.path:
+            return summarize_handler(request)
+        return httpx.Response(503, headers={"Retry-After": "0"})
+
+    mock_hf(handler)
+    for i in range(main.HF_BREAKER_FAIL_MAX):
+        assert client.post("/api/sentiment", json={"text": f"loading {i}"}).status_code == 500
+    assert client.post("/api/sentiment", json={"text": "loading again"}).status_code == 503
+
+    response = client.post("/api/summarize", json={"text": "healthy model"})
+    assert response.json() == {"result": "summary of healthy model"}
+
+def test_log_flusher_survives_write_error(client, mock_hf, monkeypatch):
+    write_log_batch = main.write_log_batch
+    failures = []
+
+    def fail_once(pool, rows):
+        if not failures:
+            failures.append(rows)
+            raise OSError("disk hiccup")
+        write_log_batch(pool, rows)
+
+    mock_hf(summarize_handler)
+    monkeypatch.setattr(main, "write_log_batch", fail_once)
+    client.post("/api/summarize", json={"text": "lost log row"})
+    time.sleep(0.2)
+    client.post("/api/summarize", json={"text": "kept log row"})
+    time.sleep(0.2)
+
+    assert failures and not client.app.state.log_flusher.done()
+    texts = [record["input_text"] for record in client.get("/api/history").json()["history"]]
+    assert "kept log row" in texts
+
+def test_log_files_rotate_and_expire(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "DATABASE_URL", str(tmp_path / "explorer.db"))
+    monkeypatch.setattr(main, "LOG_RETENTION_MONTHS", 3)
+    months = main.log_months()
+    # One retained older month with data, one month past the retention window
+    (tmp_path / f"requests_{months[2]}.db").touch()
+    (tmp_path / "requests_200001.db").touch()
+    (tmp_path / "requests_200001.db-wal").touch()
+
+    pool = main.ConnectionPool(readers=1)
+    try:
+        main.init_db(pool.write_conn)
+        main.maintain_logs(pool)
+        assert pool.months == [months[0], months[2]]
+    finally:
+        pool.close()
+
+    assert sorted(path.name for path in tmp_path.glob("requests_*")) == sorted(
+        f"requests_{month}.db" for month in (months[0], months[2])
+    )
+
+def test_pools_follow_month_boundary(tmp_path, monkeypatch):
+    monkeypatch.setattr(main, "DATABASE_URL", str(tmp_path / "explorer.db"))
+    clock = {"now": datetime(2026, 10, 31, 23, 59, tzinfo=timezone.utc)}
+    log_months = main.log_months
+    monkeypatch.setattr(main, "log_months", lambda now=None: log_months(now or clock["now"]))
+
+    # Two workers, each with its own pool on the same files
+    writer_pool = main.ConnectionPool(readers=1)
+    reader_pool = main.ConnectionPool(readers=1)
+    try:
+        main.init_db(writer_pool.write_conn)
+        for pool in (writer_pool, reader_pool):
+            main.maintain_logs(pool)
+            assert pool.current_month == "202610"
+
+        clock["now"] = datetime(2026, 11, 1, 0, 1, tzinfo=timezone.utc)
+        main.write_log_batch(writer_pool, [("summarize", "new month", "ok")])
+
+        # The reader pool never wrote or ran maintenance since the month turned
+        with reader_pool.get_reader() as db:
+            attached = [row[1] for row in db.execute("PRAGMA database_list")]
+            rows = db.execute("SELECT input_text FROM logs_202611.requests").fetchall()
+        assert "logs_202611" in attached
+        assert rows == [("new month",)]
+    finally:
+        writer_pool.close()
+        reader_pool.close()